@@ -12,9 +12,12 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from lxml.etree import XPath
+import lxml.html
+import httpx
+import asyncio
 import csv
 import re
 import time
@@ -24,25 +27,168 @@ import argparse
 # Region button IDs on the page
 REGION_BUTTONS = ["CommandHK", "CommandKLN", "CommandNT"]
 
+# CSV columns, in the order parse_html_to_data yields them
+FIELDNAMES = ['Name', 'ProfileLink', 'Description', 'Address', 'Phone', 'Lat', 'Lon', 'Programs']
+
+def _has_class(cls):
+    """XPath predicate matching elements whose class list contains cls"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')"
+
+# Compiled XPath queries for parse_html_to_data, evaluated relative to a row
+ROWS = XPath(f"//tr[.//div[{_has_class('PHName')}]]")
+NAME = XPath(f".//div[{_has_class('PHName')}]")
+PROFILE_HREF = XPath("ancestor::a[1]/@href")
+PHONE = XPath(".//a[starts-with(@href, 'tel:')]")
+PRACTICE = XPath("(.//td)[2]//span")
+MAP_LINK = XPath(".//a[contains(@href, 'map.gov.hk')]")
+ADDRESS = XPath(f".//div[{_has_class('SPListTableTd')}]")
+FALLBACK_ADDRESS = XPath(f"(.//td)[2]//div[{_has_class('SPListTableTd')}]")
+PROGRAM_ALTS = XPath(
+    f"(.//div[{_has_class('plan-list')}])[1]//div[{_has_class('plan')}]/descendant::img[1]/@alt"
+)
+TEXT = XPath(".//text()")
+WGS84_RE = re.compile(r'wgs84/([\d.]+)/([\d.]+)')
+
+# Queries used when paginating over plain HTTP
+RESULTS_CONTAINER = XPath(f"(//tr[.//div[{_has_class('PHName')}]])[1]/..")
+PAGER_HREFS = XPath(f"//*[{_has_class('pagination')}]//a/@href")
+HAS_NEXT_PAGE = XPath(
+    f"boolean(//*[{_has_class('pagination')}]//*[{_has_class('PagedList-skipToNext')}]//a[@href])"
+)
+PAGE_PARAM_RE = re.compile(r'([?&]page=)(\d+)', re.IGNORECASE)
+
+# Returns the first results page, its absolute pager hrefs and whether the
+# pager links to a next page, in one call
+FIRST_PAGE_JS = """
+return {
+    html: document.querySelector('tbody').outerHTML,
+    pager: Array.from(document.querySelectorAll('.pagination a[href]'), a => a.href),
+    hasNext: document.querySelector('.pagination .PagedList-skipToNext a[href]') !== null
+};
+"""
+
+def _text(element):
+    """Join the stripped text nodes of an element, like get_text(strip=True)"""
+    return "".join(part.strip() for part in TEXT(element))
+
 def setup_driver():
-    """Setup Chrome WebDriver for headless operation"""
+    """Setup Chrome WebDriver for headless operation
+
+    The chromedriver binary is located by Selenium Manager, which uses one
+    already on PATH or its local cache before going to the network.
+    """
     options = Options()
     options.add_argument('--headless')
     options.add_argument('--disable-gpu')
     options.add_argument('--no-sandbox')
     options.add_argument('--disable-dev-shm-usage')
     options.add_argument('--window-size=1920,1080')
-
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
+    # Nothing we scrape needs images or browser background services
+    options.add_argument('--blink-settings=imagesEnabled=false')
+    options.add_argument('--disable-extensions')
+    options.add_argument('--disable-background-networking')
+    options.add_argument('--disable-sync')
+    options.add_experimental_option('prefs', {
+        'profile.managed_default_content_settings.images': 2
+    })
+
+    driver = webdriver.Chrome(options=options)
     return driver
 
-def scrape_region(driver, region_id, base_url, max_retries=3):
+def http_client(driver):
+    """Create an HTTP/2 client that shares the browser's search session
+
+    The region filter is applied through the page's form, but the result
+    pages it leads to are plain links, so they can be fetched without the
+    browser once its cookies are copied over.
+    """
+    cookies = httpx.Cookies()
+    for cookie in driver.get_cookies():
+        cookies.set(cookie['name'], cookie['value'],
+                    domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=8),
+        cookies=cookies,
+        headers={'User-Agent': driver.execute_script("return navigator.userAgent;")},
+        timeout=30,
+        follow_redirects=True
+    )
+
+def page_urls(pager_hrefs, after_page=1):
+    """Build the URLs of the pages after after_page that a pager links to
+
+    The pager only shows a window of page numbers, so this may stop short
+    of the last page; fetch_result_pages asks again from the later pager.
+    """
+    numbered = []
+    for href in pager_hrefs:
+        match = PAGE_PARAM_RE.search(href)
+        if match:
+            numbered.append((int(match.group(2)), href, match))
+
+    if not numbered:
+        if pager_hrefs:
+            raise ValueError("Could not determine the page count from the pager")
+        return []
+
+    last_page, href, match = max(numbered, key=lambda item: item[0])
+    prefix, suffix = href[:match.start(2)], href[match.end(2):]
+    return [f"{prefix}{page}{suffix}" for page in range(after_page + 1, last_page + 1)]
+
+async def fetch_result_pages(client, pager_hrefs, has_next):
+    """Fetch the result pages after page 1, returning the results HTML of each
+
+    Pages are fetched concurrently in batches, one per window of page
+    numbers in the pager; the last page of each batch supplies the next
+    window, until its pager no longer links to a next page.
+
+    Every URL comes from the pager, so a page without results (e.g. an
+    expired session redirected to the search form) is an error rather than
+    the end of the listing; raising lets the region be retried.
+    """
+    pages_html = []
+    last_page = 1
+
+    async with client:
+        while True:
+            urls = page_urls(pager_hrefs, last_page)
+            if not urls:
+                if has_next:
+                    raise ValueError(
+                        f"Pager links past page {last_page} but shows no later page number"
+                    )
+                return pages_html
+
+            responses = await asyncio.gather(*(client.get(url) for url in urls))
+            for response in responses:
+                response.raise_for_status()
+                doc = lxml.html.document_fromstring(response.text)
+                results = RESULTS_CONTAINER(doc)
+                if not results:
+                    raise ValueError(f"No results on {response.url}")
+                pages_html.append(lxml.html.tostring(results[0], encoding='unicode'))
+
+            last_page += len(urls)
+            pager_hrefs = [urljoin(str(response.url), href) for href in PAGER_HREFS(doc)]
+            has_next = HAS_NEXT_PAGE(doc)
+
+def scrape_region(region_id, base_url, max_retries=3):
+    """Scrape a single region in its own browser session
+
+    Each call owns its WebDriver, so regions can be scraped concurrently.
+    """
+    driver = setup_driver()
+    try:
+        return _scrape_region_pages(driver, region_id, base_url, max_retries)
+    finally:
+        driver.quit()
+
+def _scrape_region_pages(driver, region_id, base_url, max_retries):
     """Scrape a single region with retry logic, handling pagination"""
     for attempt in range(max_retries):
         try:
             driver.get(base_url)
-            time.sleep(3)
 
             WebDriverWait(driver, 20).until(
                 EC.element_to_be_clickable((By.ID, region_id))
@@ -54,36 +200,26 @@ def scrape_region(driver, region_id, base_url, max_retries=3):
             WebDriverWait(driver, 30).until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, "tbody tr .PHName"))
             )
-            time.sleep(2)
 
-            all_pages_html = []
-            page_num = 1
+            # One round trip for the first page and its pager links
+            first_page = driver.execute_script(FIRST_PAGE_JS)
+            all_pages_html = [first_page['html']]
+            print(f"    {region_id}: page 1 scraped")
 
-            while True:
-                results_table = driver.find_element(By.CSS_SELECTOR, "tbody")
-                html = results_table.get_attribute('outerHTML')
-                all_pages_html.append(html)
-                print(f"    Page {page_num} scraped")
-
-                try:
-                    next_btn = driver.find_element(By.CSS_SELECTOR,
-                        ".pagination .PagedList-skipToNext a"
-                    )
-                    driver.execute_script("arguments[0].click();", next_btn)
-                    page_num += 1
-                    time.sleep(2)
-                    WebDriverWait(driver, 15).until(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, "tbody tr .PHName"))
-                    )
-                except:
-                    break
+            # The remaining pages are plain GETs; fetch them without the browser
+            if first_page['pager'] or first_page['hasNext']:
+                more_pages = asyncio.run(fetch_result_pages(
+                    http_client(driver), first_page['pager'], first_page['hasNext']
+                ))
+                all_pages_html.extend(more_pages)
+                print(f"    {region_id}: {len(more_pages)} more page(s) scraped")
 
             return "\n".join(all_pages_html)
 
         except Exception as e:
-            print(f"  Attempt {attempt + 1}/{max_retries} failed: {e}")
+            print(f"  {region_id}: attempt {attempt + 1}/{max_retries} failed: {e}")
             if attempt < max_retries - 1:
-                print(f"  Retrying in 5 seconds...")
+                print(f"  {region_id}: retrying in 5 seconds...")
                 time.sleep(5)
             else:
                 print(f"  All retries exhausted for {region_id}")
@@ -95,123 +231,149 @@ def scrape_all_regions(lang="EN"):
     Args:
         lang: Language code - "EN" for English or "TC" for Traditional Chinese
     """
-    driver = setup_driver()
     all_html_parts = []
 
     base_url = f"https://apps.pcdirectory.gov.hk/Public/{lang}/ServiceTypeAdvancedSearch?ProfID=RMP&ServiceType=TaiPoService"
 
-    try:
-        for region_id in REGION_BUTTONS:
-            print(f"Scraping region: {region_id}...")
-            html = scrape_region(driver, region_id, base_url)
-            if html:
-                all_html_parts.append(html)
-                print(f"  Got {len(html)} characters from {region_id}")
-            else:
-                print(f"  Failed to scrape {region_id}")
-    finally:
-        driver.quit()
+    print(f"Scraping regions: {', '.join(REGION_BUTTONS)}...")
+    with ThreadPoolExecutor(max_workers=len(REGION_BUTTONS)) as executor:
+        results = list(executor.map(
+            lambda region_id: scrape_region(region_id, base_url),
+            REGION_BUTTONS
+        ))
+
+    for region_id, html in zip(REGION_BUTTONS, results):
+        if html:
+            all_html_parts.append(html)
+            print(f"  Got {len(html)} characters from {region_id}")
+        else:
+            print(f"  Failed to scrape {region_id}")
 
     return "\n".join(all_html_parts)
 
 def parse_html_to_data(html_content):
-    """Parse the scraped HTML into structured data"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    data_list = []
+    """Parse the scraped HTML into rows, yielded as tuples in FIELDNAMES order
 
-    rows = soup.find_all('tr')
+    Doctors listed under more than one region are yielded once per
+    (name, address) pair.
+    """
+    doc = lxml.html.document_fromstring(html_content)
+    seen = set()
 
-    for row in rows:
-        name_div = row.find('div', class_='PHName')
-        if not name_div:
-            continue
-        name = name_div.get_text(strip=True)
+    for row in ROWS(doc):
+        name_div = NAME(row)[0]
+        name = _text(name_div)
 
         # Get the profile link from the anchor tag wrapping the name
         profile_link = ""
-        name_anchor = name_div.find_parent('a')
-        if name_anchor and name_anchor.get('href'):
-            profile_link = "https://apps.pcdirectory.gov.hk" + name_anchor.get('href')
+        name_href = PROFILE_HREF(name_div)
+        if name_href and name_href[0]:
+            profile_link = "https://apps.pcdirectory.gov.hk" + name_href[0]
 
-        phone_link = row.find('a', href=lambda x: x and x.startswith('tel:'))
-        phone = phone_link.get_text(strip=True) if phone_link else ""
+        phone_links = PHONE(row)
+        phone = _text(phone_links[0]) if phone_links else ""
 
         practice = ""
-        cols = row.find_all('td')
-        if len(cols) > 1:
-            practice_span = cols[1].find('span')
-            if practice_span:
-                practice = practice_span.get_text(strip=True)
+        practice_spans = PRACTICE(row)
+        if practice_spans:
+            practice = _text(practice_spans[0])
 
         address = ""
         lat = ""
         lon = ""
 
-        map_link = row.find('a', href=lambda x: x and 'map.gov.hk' in x)
+        map_links = MAP_LINK(row)
 
-        if map_link:
+        if map_links:
+            map_link = map_links[0]
             href = map_link.get('href', '')
-            match = re.search(r'wgs84/([\d\.]+)/([\d\.]+)', href)
+            match = WGS84_RE.search(href)
             if match:
                 lat = match.group(1)
                 lon = match.group(2)
 
-            addr_div = map_link.find('div', class_='SPListTableTd')
-            if addr_div:
-                address = addr_div.get_text(strip=True)
+            addr_divs = ADDRESS(map_link)
+            if addr_divs:
+                address = _text(addr_divs[0])
 
-        if not address and len(cols) > 1:
-            addr_divs = cols[1].find_all('div', class_='SPListTableTd')
-            for div in addr_divs:
-                text = div.get_text(strip=True)
+        if not address:
+            for div in FALLBACK_ADDRESS(row):
+                text = _text(div)
                 if text and "Show Map" not in text:
                     address = text
                     break
 
         address = " ".join(address.split())
 
-        programs = []
-        plan_list = row.find('div', class_='plan-list')
-        if plan_list:
-            program_divs = plan_list.find_all('div', class_='plan')
-            for prog in program_divs:
-                img = prog.find('img')
-                if img and img.get('alt'):
-                    programs.append(img.get('alt'))
-
-        if name and address:
-            data_list.append({
-                'Name': name,
-                'ProfileLink': profile_link,
-                'Description': practice,
-                'Address': address,
-                'Phone': phone,
-                'Lat': lat,
-                'Lon': lon,
-                'Programs': "; ".join(programs)
-            })
-
-    return data_list
-
-def save_to_csv(data_list, output_filename="doctors.csv"):
-    """Save data to CSV file"""
-    if not data_list:
+        programs = [alt for alt in PROGRAM_ALTS(row) if alt]
+
+        if not (name and address):
+            continue
+
+        key = (name, address)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        yield (name, profile_link, practice, address, phone, lat, lon, "; ".join(programs))
+
+def save_to_csv(rows, output_filename="doctors.csv"):
+    """Stream rows to a CSV file, returning the number of records written
+
+    The file is left untouched when there are no rows, so a failed scrape
+    never replaces the existing data with an empty file.
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
         print("No data to save")
-        return
+        return 0
+
+    count = 1
+    # A 1 MiB buffer lets the whole file go out in a handful of writes
+    with open(output_filename, 'w', newline='', encoding='utf-8', buffering=1 << 20) as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(FIELDNAMES)
+        writer.writerow(first_row)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+
+    print(f"Saved {count} records to {output_filename}")
+    return count
+
+def save_to_parquet(csv_filename):
+    """Write a typed, zstd-compressed Parquet copy of a saved CSV file
+
+    Lat/Lon are stored as float32 and every other column as a string, so
+    phone numbers keep their digits as written. Requires pyarrow, which is
+    only needed when --parquet is given.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
 
-    fieldnames = ['Name', 'ProfileLink', 'Description', 'Address', 'Phone', 'Lat', 'Lon', 'Programs']
+    column_types = {name: pa.string() for name in FIELDNAMES}
+    column_types['Lat'] = pa.float32()
+    column_types['Lon'] = pa.float32()
 
-    with open(output_filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(data_list)
+    # Names and descriptions can carry newlines inside quoted values
+    table = pa_csv.read_csv(
+        csv_filename,
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types)
+    )
+    parquet_filename = os.path.splitext(csv_filename)[0] + ".parquet"
+    pq.write_table(table, parquet_filename, compression='zstd')
 
-    print(f"Saved {len(data_list)} records to {output_filename}")
+    print(f"Saved {table.num_rows} records to {parquet_filename}")
 
 def main():
     parser = argparse.ArgumentParser(description='Scrape HK Primary Care Directory')
     parser.add_argument('--lang', choices=['EN', 'TC'], default='EN',
                         help='Language: EN for English, TC for Traditional Chinese')
+    parser.add_argument('--parquet', action='store_true',
+                        help='Also write a Parquet copy of the CSV (requires pyarrow)')
     args = parser.parse_args()
 
     lang = args.lang
@@ -227,14 +389,14 @@ def main():
         return
 
     print("\nParsing scraped data...")
-    data_list = parse_html_to_data(html_content)
-    print(f"Parsed {len(data_list)} doctor records")
-
     script_dir = os.path.dirname(os.path.abspath(__file__))
     # Use doctors.csv for English, doctors_tc.csv for Traditional Chinese
     csv_filename = "doctors.csv" if lang == "EN" else "doctors_tc.csv"
     csv_file = os.path.join(script_dir, csv_filename)
-    save_to_csv(data_list, csv_file)
+    saved = save_to_csv(parse_html_to_data(html_content), csv_file)
+
+    if saved and args.parquet:
+        save_to_parquet(csv_file)
 
     print("\nDone!")
 